@@ -1,15 +1,25 @@
 """Desktop GUI tool for generating Premiere Pro assets from a script."""
 from __future__ import annotations
 
+import os
+import queue
 import tkinter as tk
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from tkinter import filedialog, messagebox, ttk
 from pathlib import Path
-from typing import List
+from typing import Callable, List, Optional, Tuple
 
-from src.yukkuri_gen.aquestalk import AquesTalkGenerator, AudioGenerationError
+from src.yukkuri_gen.aquestalk import AquesTalkGenerator, AudioGenerationError, clear_cache
 from src.yukkuri_gen.parser import DialogueLine, ScriptParser, ScriptParseError
 from src.yukkuri_gen.premiere import PremiereXmlBuilder
 
+AUDIO_CACHE_DIRNAME = ".cache"
+UI_POLL_INTERVAL_MS = 50
+LOG_FLUSH_INTERVAL_MS = 100
+LOG_MAX_LINES = 10_000
+
 
 class Application(ttk.Frame):
     def __init__(self, master: tk.Tk) -> None:
@@ -17,7 +27,16 @@ class Application(ttk.Frame):
         self.master = master
         self.pack(fill=tk.BOTH, expand=True)
         self.master.title("WIndows Yukkuri Generator")
+        # 音声生成はバックグラウンドで実行し、ウィジェットの操作はキュー経由でメインスレッドに渡す。
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        self._ui_queue: queue.Queue[Callable[[], None]] = queue.Queue()
+        # 直近に生成した音声の (出力フォルダ, ファイル一覧)。XML生成時にフォルダを走査せずに済む。
+        self._generated_audio: Optional[Tuple[Path, List[Path]]] = None
+        # ログはまず溜めておき、一定間隔でまとめてウィジェットへ書き込む。
+        self._pending_log: deque[str] = deque(maxlen=LOG_MAX_LINES)
         self._build_widgets()
+        self.after(UI_POLL_INTERVAL_MS, self._drain_ui_queue)
+        self.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
 
     def _build_widgets(self) -> None:
         # Configuration frame
@@ -45,8 +64,14 @@ class Application(ttk.Frame):
         button_frame.pack(fill=tk.X, padx=10, pady=5)
 
         ttk.Button(button_frame, text="台本を読み込み", command=self._load_script_file).pack(side=tk.LEFT)
-        ttk.Button(button_frame, text="音声生成", command=self._generate_audio).pack(side=tk.LEFT, padx=5)
-        ttk.Button(button_frame, text="Premiere XML生成", command=self._generate_premiere_xml).pack(side=tk.LEFT)
+        generate_button = ttk.Button(button_frame, text="音声生成", command=self._generate_audio)
+        generate_button.pack(side=tk.LEFT, padx=5)
+        export_button = ttk.Button(button_frame, text="Premiere XML生成", command=self._generate_premiere_xml)
+        export_button.pack(side=tk.LEFT)
+        clear_cache_button = ttk.Button(button_frame, text="音声キャッシュを削除", command=self._clear_audio_cache)
+        clear_cache_button.pack(side=tk.LEFT, padx=5)
+        # 音声生成中は出力フォルダとキャッシュが書き換わるため、これらの操作を受け付けない。
+        self._synthesis_buttons = [generate_button, export_button, clear_cache_button]
 
         # Log output
         log_frame = ttk.LabelFrame(self, text="ログ")
@@ -94,27 +119,60 @@ class Application(ttk.Frame):
             raise
 
     def _generate_audio(self) -> None:
-        try:
-            dialogues = self._parse_script()
-        except ScriptParseError:
-            return
-
         config_path = Path(self.config_path_var.get())
         if not config_path.exists():
             messagebox.showerror("設定エラー", f"AquesTalk設定ファイルが見つかりません: {config_path}")
             return
 
-        generator = AquesTalkGenerator.from_config(Path(self.audio_dir_var.get()), config_path)
+        audio_dir = Path(self.audio_dir_var.get())
+        generator = AquesTalkGenerator.from_config(audio_dir, config_path, cache_dir=audio_dir / AUDIO_CACHE_DIRNAME)
+        content = self.script_text.get("1.0", tk.END)
+        # 合成が始まると以前の出力は削除・上書きされるため、成功するまで記憶した一覧は使わない。
+        self._generated_audio = None
+        self._set_synthesis_running(True)
+        self._log("音声生成を開始します")
+        self._worker.submit(self._run_synthesis, generator, content)
+
+    def _set_synthesis_running(self, running: bool) -> None:
+        for button in self._synthesis_buttons:
+            button.state(["disabled"] if running else ["!disabled"])
 
+    def _run_synthesis(self, generator: AquesTalkGenerator, content: str) -> None:
         try:
-            files = generator.synthesize(dialogues)
+            self._synthesize(generator, content)
+        finally:
+            self._call_in_ui(partial(self._set_synthesis_running, False))
+
+    def _synthesize(self, generator: AquesTalkGenerator, content: str) -> None:
+        # 台本の解析と音声合成を並行させるため、解析結果はジェネレータのまま渡す。
+        dialogues = ScriptParser().iter_parse(content)
+        try:
+            files = generator.synthesize(dialogues, on_generated=lambda path: self._log(f"生成: {path.name}"))
+        except ScriptParseError as exc:
+            self._call_in_ui(partial(messagebox.showerror, "台本エラー", str(exc)))
+            self._log(f"音声生成に失敗: {exc}")
+            return
         except AudioGenerationError as exc:
-            messagebox.showerror("音声生成エラー", str(exc))
+            self._call_in_ui(partial(messagebox.showerror, "音声生成エラー", str(exc)))
             self._log(f"音声生成に失敗: {exc}")
             return
+        except Exception as exc:
+            # ワーカースレッドの例外は Tk に届かないため、ここで必ず利用者に知らせる。
+            self._call_in_ui(partial(messagebox.showerror, "音声生成エラー", f"{type(exc).__name__}: {exc}"))
+            self._log(f"音声生成に失敗: {type(exc).__name__}: {exc}")
+            return
 
+        self._call_in_ui(partial(self._remember_generated_audio, generator.output_dir, files))
         self._log(f"音声を生成しました ({len(files)}件) -> {generator.output_dir}")
 
+    def _remember_generated_audio(self, audio_dir: Path, files: List[Path]) -> None:
+        self._generated_audio = (audio_dir, files)
+
+    def _clear_audio_cache(self) -> None:
+        cache_dir = Path(self.audio_dir_var.get()) / AUDIO_CACHE_DIRNAME
+        clear_cache(cache_dir)
+        self._log(f"音声キャッシュを削除しました: {cache_dir}")
+
     def _generate_premiere_xml(self) -> None:
         try:
             dialogues = self._parse_script()
@@ -122,23 +180,60 @@ class Application(ttk.Frame):
             return
 
         audio_dir = Path(self.audio_dir_var.get())
-        audio_files = sorted(audio_dir.glob("*.wav")) if audio_dir.exists() else []
+        audio_files = self._list_audio_files(audio_dir)
         builder = PremiereXmlBuilder()
         clips = builder.build_timeline(dialogues, audio_files)
-        xml_content = builder.build_xml(self.project_name_var.get(), clips)
 
         output_dir = Path(self.xml_output_var.get())
         output_dir.mkdir(parents=True, exist_ok=True)
         output_path = output_dir / f"{self.project_name_var.get()}.xml"
-        output_path.write_text(xml_content, encoding="utf-8")
+        with open(output_path, "wb", buffering=1 << 20) as fp:
+            fp.writelines(builder.iter_xml_bytes(self.project_name_var.get(), clips))
         self._log(f"Premiere XMLを出力しました: {output_path}")
         messagebox.showinfo("完了", f"Premiere XMLを出力しました\n{output_path}")
 
+    def _call_in_ui(self, callback: Callable[[], None]) -> None:
+        self._ui_queue.put(callback)
+
+    def _drain_ui_queue(self) -> None:
+        while True:
+            try:
+                callback = self._ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            callback()
+        self.after(UI_POLL_INTERVAL_MS, self._drain_ui_queue)
+
+    def _list_audio_files(self, audio_dir: Path) -> List[Path]:
+        if self._generated_audio is not None and self._generated_audio[0] == audio_dir:
+            return list(self._generated_audio[1])
+        if not audio_dir.is_dir():
+            return []
+        # 音声は "0001_話者.wav" の形式で保存されるため、名前順に並べれば台本の順序になる。
+        with os.scandir(audio_dir) as entries:
+            return sorted(
+                (Path(entry.path) for entry in entries if entry.name.lower().endswith(".wav") and entry.is_file()),
+                key=lambda path: path.name,
+            )
+
     def _log(self, message: str) -> None:
-        self.log_text.configure(state=tk.NORMAL)
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.configure(state=tk.DISABLED)
-        self.log_text.see(tk.END)
+        """Queue ``message`` for the log; safe to call from any thread."""
+        self._pending_log.append(message)
+
+    def _flush_log(self) -> None:
+        messages = []
+        while self._pending_log:
+            messages.append(self._pending_log.popleft())
+        if messages:
+            self.log_text.configure(state=tk.NORMAL)
+            self.log_text.insert(tk.END, "\n".join(messages) + "\n")
+            # 末尾の改行の後ろの空行を除いた行数が上限を超えたら、古い行から捨てる。
+            excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            self.log_text.configure(state=tk.DISABLED)
+            self.log_text.see(tk.END)
+        self.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
 
 
 def main() -> None:
@@ -1,17 +1,27 @@
 """Integration utilities for generating audio clips with AquesTalk."""
 from __future__ import annotations
 
+import hashlib
 import json
+import logging
 import os
 import shlex
+import shutil
 import subprocess
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from functools import lru_cache, partial
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import List, Optional, Tuple
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
 
 from .parser import DialogueLine
 
+CACHE_MANIFEST_NAME = "manifest.json"
+
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class VoicePreset:
@@ -20,7 +30,9 @@ class VoicePreset:
     When ``use_text_file`` is enabled the dialogue text is written to a temporary
     file using ``text_file_encoding`` and the resulting path is provided via the
     ``{text_file}`` placeholder so command line tools such as ``aquostalk.exe``
-    can consume it.
+    can consume it. The file is only written when the template actually uses
+    ``{text_file}``. With ``use_stdin`` the text is instead piped to the command's
+    standard input, encoded with ``text_file_encoding``, and no file is written.
     """
 
     speaker: str
@@ -32,6 +44,24 @@ class VoicePreset:
     use_text_file: bool = False
     text_file_encoding: str = "utf-8"
     text_file_suffix: str = ".txt"
+    use_stdin: bool = False
+
+    # (token, has_placeholder) pairs parsed once from ``command_template``.
+    _tokens: List[Tuple[str, bool]] = field(init=False, repr=False, compare=False)
+    _needs_text_file: bool = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # コマンドテンプレートは引数単位でプレースホルダを差し替えるため、先に分解してから
+        # `str.format` を適用する。こうすることで `{output}` や `{text}` に空白が含まれていても
+        # 単一の引数として扱われ、Windows環境でも安全に実行できる。分解結果はプリセットごとに
+        # 変わらないので、ここで一度だけ行う。
+        self._tokens = [
+            (token, "{" in token or "}" in token)
+            for token in shlex.split(self.command_template, posix=os.name != "nt")
+        ]
+        self._needs_text_file = (
+            self.use_text_file and not self.use_stdin and "{text_file}" in self.command_template
+        )
 
     def build_command(self, text: str, output_path: Path) -> Tuple[List[str], Optional[Path]]:
         context = {
@@ -43,7 +73,7 @@ class VoicePreset:
             "output": str(output_path),
         }
         temp_path: Optional[Path] = None
-        if self.use_text_file:
+        if self._needs_text_file:
             with NamedTemporaryFile(
                 "w",
                 encoding=self.text_file_encoding,
@@ -55,59 +85,226 @@ class VoicePreset:
             context["text_file"] = str(temp_path)
         else:
             context["text_file"] = ""
-        # コマンドテンプレートは引数単位でプレースホルダを差し替えるため、先に分解してから
-        # `str.format` を適用する。こうすることで `{output}` や `{text}` に空白が含まれていても
-        # 単一の引数として扱われ、Windows環境でも安全に実行できる。
-        tokens = shlex.split(self.command_template, posix=os.name != "nt")
-        return [token.format(**context) for token in tokens], temp_path
+        command = [
+            token.format_map(context) if has_placeholder else token
+            for token, has_placeholder in self._tokens
+        ]
+        return command, temp_path
+
+    def stdin_input(self, text: str) -> Optional[bytes]:
+        """Return the bytes to feed to the command's standard input, if any."""
+        if not self.use_stdin:
+            return None
+        return text.encode(self.text_file_encoding)
+
+    def cache_key(self, text: str) -> str:
+        """Return the key identifying the audio this preset produces for ``text``.
+
+        Every configurable field is hashed, since any of them (including how the
+        text reaches the tool and in which encoding) can change the output.
+        """
+        settings = {item.name: getattr(self, item.name) for item in fields(self) if item.init}
+        source = json.dumps({"preset": settings, "text": text}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
 
 
 class AudioGenerationError(RuntimeError):
     pass
 
 
+class _SynthesisJob(NamedTuple):
+    dialogue: DialogueLine
+    preset: VoicePreset
+    output_path: Path
+    cache_key: Optional[str]
+
+
+def _run_preset_command(preset: VoicePreset, text: str, output_path: Path) -> None:
+    # 一時ファイルは実行直前にワーカー内で作るため、同時に存在するのは実行中の分だけになる。
+    command, temp_path = preset.build_command(text, output_path)
+    try:
+        subprocess.run(command, input=preset.stdin_input(text), check=True)
+    finally:
+        if temp_path is not None:
+            try:
+                temp_path.unlink()
+            except OSError:
+                pass
+
+
+def _link_or_copy(source: Path, destination: Path) -> None:
+    try:
+        destination.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+@lru_cache(maxsize=8)
+def _load_presets(config_path: str, mtime_ns: int) -> dict[str, VoicePreset]:
+    # 更新時刻もキーに含めるため、設定ファイルが編集されれば次回の呼び出しで読み直される。
+    data = json.loads(Path(config_path).read_text(encoding="utf-8"))
+    return {
+        entry["speaker"]: VoicePreset(**entry)
+        for entry in data.get("presets", [])
+    }
+
+
+def _notify_generated(callback: Callable[[Path], None], output_path: Path, future: Future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        callback(output_path)
+
+
+def clear_cache(cache_dir: Path) -> None:
+    """Remove every cached clip stored in ``cache_dir``."""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
 class AquesTalkGenerator:
-    """Generate voice clips via the user supplied AquesTalk command templates."""
+    """Generate voice clips via the user supplied AquesTalk command templates.
 
-    def __init__(self, output_dir: Path, presets: dict[str, VoicePreset]) -> None:
+    Each dialogue line is synthesized by an independent AquesTalk process, so up to
+    ``concurrency`` processes are run at the same time. When ``cache_dir`` is set,
+    generated clips are kept there keyed by preset and text so unchanged lines are
+    reused instead of being synthesized again.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        presets: dict[str, VoicePreset],
+        concurrency: int = 4,
+        cache_dir: Optional[Path] = None,
+    ) -> None:
         self.output_dir = output_dir
         self.presets = presets
+        self.concurrency = max(1, concurrency)
+        self.cache_dir = cache_dir
 
     @classmethod
-    def from_config(cls, output_dir: Path, config_path: Path) -> "AquesTalkGenerator":
-        data = json.loads(config_path.read_text(encoding="utf-8"))
-        presets = {
-            entry["speaker"]: VoicePreset(**entry)
-            for entry in data.get("presets", [])
-        }
-        return cls(output_dir=output_dir, presets=presets)
+    def from_config(
+        cls,
+        output_dir: Path,
+        config_path: Path,
+        concurrency: int = 4,
+        cache_dir: Optional[Path] = None,
+    ) -> "AquesTalkGenerator":
+        presets = _load_presets(str(config_path), config_path.stat().st_mtime_ns)
+        return cls(output_dir=output_dir, presets=dict(presets), concurrency=concurrency, cache_dir=cache_dir)
 
     def ensure_output_dir(self) -> None:
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def synthesize(
+        self,
+        dialogues: Iterable[DialogueLine],
+        on_generated: Optional[Callable[[Path], None]] = None,
+    ) -> list[Path]:
+        """Synthesize every dialogue line and return the clip paths in script order.
 
-    def synthesize(self, dialogues: Iterable[DialogueLine]) -> list[Path]:
+        ``dialogues`` is consumed lazily, so passing :meth:`ScriptParser.iter_parse`
+        starts the first AquesTalk process while the rest of the script is still
+        being parsed. ``on_generated`` is called with each finished clip, possibly
+        from a worker thread.
+        """
         self.ensure_output_dir()
+        pending: deque[Tuple[_SynthesisJob, Future]] = deque()
         generated: list[Path] = []
-        for index, dialogue in enumerate(dialogues, start=1):
-            preset = self.presets.get(dialogue.normalized_speaker())
-            if preset is None:
-                raise AudioGenerationError(f"No voice preset configured for speaker {dialogue.speaker!r}")
-
-            output_path = self.output_dir / f"{index:04d}_{preset.speaker}.wav"
-            command, temp_path = preset.build_command(dialogue.normalized_text(), output_path)
-            command_args = list(command)
-            try:
-                subprocess.run(command_args, check=True)
-            except subprocess.CalledProcessError as exc:
-                raise AudioGenerationError(
-                    f"AquesTalk command failed for speaker {dialogue.speaker!r}: {command_args}") from exc
-            finally:
-                if temp_path is not None:
-                    try:
-                        temp_path.unlink()
-                    except OSError:
-                        pass
-
-            generated.append(output_path)
+        # 完了した行はその都度キャッシュへ登録し、途中で失敗しても次回は残りの行だけを合成する。
+        manifest_entries: dict[str, dict[str, object]] = {}
+        try:
+            # subprocess.run は子プロセスの終了待ちの間 GIL を解放するため、スレッドで十分に並列化できる。
+            # 結果は投入順に回収し、エラーは台本の順序どおりに報告する。
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                try:
+                    for index, dialogue in enumerate(dialogues, start=1):
+                        preset = self.presets.get(dialogue.speaker)
+                        if preset is None:
+                            raise AudioGenerationError(f"No voice preset configured for speaker {dialogue.speaker!r}")
+
+                        output_path = self.output_dir / f"{index:04d}_{preset.speaker}.wav"
+                        generated.append(output_path)
+                        cache_key: Optional[str] = None
+                        if self.cache_dir is not None:
+                            cache_key = preset.cache_key(dialogue.text)
+                            cached_path = self.cache_dir / f"{cache_key}.wav"
+                            if cached_path.exists():
+                                _link_or_copy(cached_path, output_path)
+                                if on_generated is not None:
+                                    on_generated(output_path)
+                                continue
+
+                        # 出力先がキャッシュへのハードリンクのまま上書きされるとキャッシュまで壊れるため、先に削除する。
+                        try:
+                            output_path.unlink()
+                        except FileNotFoundError:
+                            pass
+                        job = _SynthesisJob(dialogue, preset, output_path, cache_key)
+                        future = executor.submit(_run_preset_command, preset, dialogue.text, output_path)
+                        if on_generated is not None:
+                            future.add_done_callback(partial(_notify_generated, on_generated, output_path))
+                        pending.append((job, future))
+
+                        # 未回収の仕事を並列数の2倍までに抑え、台本の読み進めが合成より先走らないようにする。
+                        while len(pending) >= 2 * self.concurrency:
+                            self._collect(*pending.popleft(), manifest_entries)
+
+                    while pending:
+                        self._collect(*pending.popleft(), manifest_entries)
+                except BaseException:
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    # 失敗した行より後ろでも、既に合成を終えていた行はキャッシュしておく。
+                    for job, future in pending:
+                        if not future.cancelled() and future.exception() is None:
+                            self._store_in_cache(job, manifest_entries)
+                    raise
+        finally:
+            self._write_manifest(manifest_entries)
 
         return generated
+
+    def _collect(self, job: _SynthesisJob, future: Future, manifest_entries: dict[str, dict[str, object]]) -> None:
+        try:
+            future.result()
+        except subprocess.CalledProcessError as exc:
+            raise AudioGenerationError(
+                f"AquesTalk command failed for speaker {job.dialogue.speaker!r}: {exc.cmd}") from exc
+        except OSError as exc:
+            raise AudioGenerationError(
+                f"Could not run AquesTalk command for speaker {job.dialogue.speaker!r}: {exc}") from exc
+        self._store_in_cache(job, manifest_entries)
+
+    def _store_in_cache(self, job: _SynthesisJob, manifest_entries: dict[str, dict[str, object]]) -> None:
+        if self.cache_dir is None or job.cache_key is None:
+            return
+        try:
+            _link_or_copy(job.output_path, self.cache_dir / f"{job.cache_key}.wav")
+        except OSError:
+            return
+        manifest_entries[job.cache_key] = {
+            "speaker": job.preset.speaker,
+            "voice_id": job.preset.voice_id,
+            "speed": job.preset.speed,
+            "volume": job.preset.volume,
+            "text": job.dialogue.text,
+        }
+
+    def _write_manifest(self, manifest_entries: dict[str, dict[str, object]]) -> None:
+        # manifest.json は調査用の付帯情報なので、書けなくても合成結果は失敗扱いにしない。
+        if self.cache_dir is None or not manifest_entries:
+            return
+        manifest_path = self.cache_dir / CACHE_MANIFEST_NAME
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.update(manifest_entries)
+        try:
+            manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+        except OSError as exc:
+            logger.warning("Could not write audio cache manifest %s: %s", manifest_path, exc)
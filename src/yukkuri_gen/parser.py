@@ -1,26 +1,48 @@
 """Utilities for parsing scenario scripts into structured dialogue entries."""
 from __future__ import annotations
 
+import re
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Iterator, List, Optional
 
 SPEAKER_SEPARATOR = "\u3000"  # full width space
 
+# 1行分の書式を表す正規表現。前後の空白を除いた行が
+#   "- " で始まればセクション見出し、
+#   それ以外で全角スペースを含めば「話者（全角スペース）セリフ」
+# として扱う。空白のみの行や書式に合わない行にはマッチしない。
+_LINE_RE = re.compile(
+    r"^[^\S\n]*(?:"
+    r"- [^\S\n]*(?P<section>\S[^\n]*?)"
+    r"|(?P<speaker>\S[^\n\u3000]*)\u3000[^\S\n]*(?P<text>\S[^\n]*?)"
+    r")[^\S\n]*$",
+    re.MULTILINE,
+)
+
 
 @dataclass
 class DialogueLine:
-    """Represents one line of dialogue in the script."""
+    """Represents one line of dialogue in the script.
+
+    ``speaker`` and ``text`` are normalized once on construction (surrounding
+    whitespace removed, inner whitespace runs collapsed in ``text``), so callers
+    can read the attributes directly.
+    """
 
     speaker: str
     text: str
     section: Optional[str] = None
 
+    def __post_init__(self) -> None:
+        self.speaker = self.speaker.strip()
+        self.text = " ".join(self.text.split())
+
     def normalized_speaker(self) -> str:
-        return self.speaker.strip()
+        return self.speaker
 
     def normalized_text(self) -> str:
-        return " ".join(self.text.strip().split())
+        return self.text
 
 
 class ScriptParseError(Exception):
@@ -34,31 +56,38 @@ class ScriptParser:
         self.default_section = default_section
 
     def parse(self, text: str) -> List[DialogueLine]:
-        section = self.default_section
-        dialogues: List[DialogueLine] = []
+        return list(self.iter_parse(text))
 
-        for raw_line in self._iter_lines(text):
-            line = raw_line.strip()
-            if not line:
-                continue
+    def iter_parse(self, text: str) -> Iterator[DialogueLine]:
+        """Yield dialogue lines one by one while scanning ``text``.
 
-            if line.startswith("- "):
-                section = line[2:].strip() or section
-                continue
+        A malformed line raises :class:`ScriptParseError` once iteration reaches it.
+        """
+        section = self.default_section
+        # 正規表現は "\n" でしか行を区切らないため、splitlines() が認める他の改行文字
+        # （"\r", "\x0c", "\u2028" など）も先に "\n" へ揃えておく。
+        text = "\n".join(text.splitlines())
 
-            if SPEAKER_SEPARATOR in line:
-                speaker, content = line.split(SPEAKER_SEPARATOR, 1)
-                dialogues.append(DialogueLine(speaker=speaker.strip(), text=content.strip(), section=section))
-                continue
+        last_end = 0
+        for match in _LINE_RE.finditer(text):
+            self._check_skipped(text[last_end:match.start()])
+            last_end = match.end()
 
-            raise ScriptParseError(f"Invalid line format: {raw_line!r}")
+            if match.group("section") is not None:
+                section = match.group("section") or section
+                continue
 
-        return dialogues
+            yield DialogueLine(speaker=match.group("speaker"), text=match.group("text"), section=section)
+        self._check_skipped(text[last_end:])
 
     def parse_file(self, path: Path) -> List[DialogueLine]:
         return self.parse(path.read_text(encoding="utf-8"))
 
     @staticmethod
-    def _iter_lines(text: str) -> Iterable[str]:
-        for raw_line in text.splitlines():
-            yield raw_line
+    def _check_skipped(skipped: str) -> None:
+        """Raise for the first non-blank line between two matched lines."""
+        if not skipped.strip():
+            return
+        for raw_line in skipped.splitlines():
+            if raw_line.strip():
+                raise ScriptParseError(f"Invalid line format: {raw_line!r}")
@@ -1,16 +1,143 @@
 """Generate Final Cut Pro XML files that Premiere Pro can import."""
 from __future__ import annotations
 
-import datetime as dt
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from itertools import accumulate
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Iterable, Iterator, List, Optional
 import wave
 
 from .parser import DialogueLine
 
 DEFAULT_FRAME_RATE = 30
 DEFAULT_AUDIO_SAMPLERATE = 44100
+_CANONICAL_WAV_HEADER_SIZE = 44
+
+# XML 1.0 では制御文字（タブ・改行・復帰を除く）やサロゲート、U+FFFE/U+FFFF は
+# 文字参照としても記述できないため、エスケープではなく取り除く。
+_XML_INVALID_CHARS = [
+    *(code for code in range(0x20) if chr(code) not in "\t\n\r"),
+    *range(0xD800, 0xE000),
+    0xFFFE,
+    0xFFFF,
+]
+_XML_ESCAPE = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&apos;",
+    **dict.fromkeys(map(chr, _XML_INVALID_CHARS)),
+})
+
+# クリップ数に依存しない部分は一度だけ組み立てておき、書き出し時はそのまま流し込む。
+_SEQUENCE_HEADER = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE xmeml>
+<xmeml version="5">
+  <sequence id="sequence-1">
+    <name>{name}</name>
+    <duration>0</duration>
+    <rate>
+      <timebase>{fps}</timebase>
+      <ntsc>FALSE</ntsc>
+    </rate>
+    <media>
+      <video>
+        <format>
+          <samplecharacteristics>
+            <rate><timebase>{fps}</timebase><ntsc>FALSE</ntsc></rate>
+            <width>1920</width>
+            <height>1080</height>
+            <anamorphic>FALSE</anamorphic>
+            <pixelaspectratio>square</pixelaspectratio>
+          </samplecharacteristics>
+        </format>
+        <track>
+"""
+
+_TITLE_CLIP_TEMPLATE = """\
+          <generatoritem id="title-{index}">
+            <name>{speaker} Subtitle</name>
+            <generatoritemtype>text</generatoritemtype>
+            <rate>
+              <timebase>{fps}</timebase>
+              <ntsc>FALSE</ntsc>
+            </rate>
+            <start>{start}</start>
+            <end>{end}</end>
+            <in>{start}</in>
+            <out>{end}</out>
+            <alphatype>straight</alphatype>
+            <effect>
+              <name>Text</name>
+              <effectid>text</effectid>
+              <effectcategory>Text</effectcategory>
+              <effecttype>text</effecttype>
+              <mediatype>video</mediatype>
+              <parameter authoringApp="PremierePro">
+                <parameterid>str</parameterid>
+                <name>テキスト</name>
+                <value>{caption}</value>
+              </parameter>
+              <parameter authoringApp="PremierePro">
+                <parameterid>style</parameterid>
+                <name>スタイル</name>
+                <value>{style}</value>
+              </parameter>
+            </effect>
+          </generatoritem>
+"""
+
+_AUDIO_CLIP_TEMPLATE = """\
+          <clipitem id="audio-{index}">
+            <name>{name}</name>
+            <start>{start}</start>
+            <end>{end}</end>
+            <in>{start}</in>
+            <out>{end}</out>
+{file}\
+          </clipitem>
+"""
+
+_AUDIO_FILE_TEMPLATE = """\
+            <file id="{file_id}">
+              <name>{name}</name>
+              <pathurl>{url}</pathurl>
+              <rate>
+                <timebase>{rate}</timebase>
+                <ntsc>FALSE</ntsc>
+              </rate>
+            </file>
+"""
+
+_AUDIO_FILE_REF_TEMPLATE = """\
+            <file id="{file_id}"/>
+"""
+
+_VIDEO_TO_AUDIO = b"""\
+        </track>
+      </video>
+      <audio>
+        <track>
+"""
+
+_SEQUENCE_FOOTER = b"""\
+        </track>
+      </audio>
+    </media>
+  </sequence>
+</xmeml>
+"""
+
+
+def _frames_to_timecode(frame: int, fps: int) -> str:
+    hours, remainder = divmod(frame, fps * 3600)
+    minutes, remainder = divmod(remainder, fps * 60)
+    seconds, frames = divmod(remainder, fps)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}:{frames:02d}"
 
 
 @dataclass
@@ -20,27 +147,49 @@ class TimelineClip:
     dialogue: DialogueLine
     audio_path: Optional[Path]
     duration_seconds: float
+    audio_path_resolved: Optional[Path] = None
 
     def duration_frames(self, fps: int = DEFAULT_FRAME_RATE) -> int:
         return int(round(self.duration_seconds * fps))
 
     def start_timecode(self, start_frame: int, fps: int = DEFAULT_FRAME_RATE) -> str:
-        seconds = start_frame / fps
-        td = dt.timedelta(seconds=seconds)
-        return self._format_timedelta(td)
+        return _frames_to_timecode(start_frame, fps)
 
     def end_timecode(self, start_frame: int, fps: int = DEFAULT_FRAME_RATE) -> str:
-        end_seconds = (start_frame + self.duration_frames(fps)) / fps
-        td = dt.timedelta(seconds=end_seconds)
-        return self._format_timedelta(td)
+        return _frames_to_timecode(start_frame + self.duration_frames(fps), fps)
 
-    @staticmethod
-    def _format_timedelta(td: dt.timedelta) -> str:
-        total_seconds = int(td.total_seconds())
-        frames = int(round((td.total_seconds() - total_seconds) * DEFAULT_FRAME_RATE))
-        hours, remainder = divmod(total_seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}:{frames:02d}"
+
+def _read_wav_duration(audio_path: Path) -> Optional[float]:
+    """Return the length of a WAV file in seconds, or ``None`` when it cannot be read.
+
+    Files using the canonical 44 byte header are measured from the header alone;
+    anything else is handed to the :mod:`wave` module.
+    """
+    try:
+        with open(audio_path, "rb") as handle:
+            header = handle.read(_CANONICAL_WAV_HEADER_SIZE)
+    except OSError:
+        return None
+
+    if (
+        len(header) == _CANONICAL_WAV_HEADER_SIZE
+        and header[0:4] == b"RIFF"
+        and header[8:16] == b"WAVEfmt "
+        and header[36:40] == b"data"
+    ):
+        fmt_size, _, channels, sample_rate, _, _, bits = struct.unpack("<IHHIIHH", header[16:36])
+        (data_size,) = struct.unpack("<I", header[40:44])
+        frame_size = channels * ((bits + 7) // 8)
+        if fmt_size == 16 and sample_rate and frame_size and data_size:
+            return (data_size // frame_size) / float(sample_rate)
+
+    try:
+        with wave.open(str(audio_path), "rb") as handle:
+            frames = handle.getnframes()
+            rate = handle.getframerate() or DEFAULT_AUDIO_SAMPLERATE
+            return frames / float(rate)
+    except (wave.Error, EOFError):
+        return None
 
 
 class PremiereXmlBuilder:
@@ -50,136 +199,97 @@ class PremiereXmlBuilder:
         self.fps = fps
 
     def build_timeline(self, dialogues: Iterable[DialogueLine], audio_files: List[Path]) -> List[TimelineClip]:
+        dialogues = list(dialogues)
+        audio_paths = [audio_files[index] if index < len(audio_files) else None for index in range(len(dialogues))]
+        # 長さの取得はほぼファイルI/O待ちなので、スレッドで並行させて先読みを重ねる。
+        with ThreadPoolExecutor() as executor:
+            durations = list(executor.map(self._estimate_duration, dialogues, audio_paths))
+        # 音声はほぼ同じフォルダにあるため、絶対パスの解決はフォルダごとに一度だけ行う。
+        resolved_dirs: dict[Path, Path] = {}
         clips: List[TimelineClip] = []
-        for index, dialogue in enumerate(dialogues):
-            audio_path = audio_files[index] if index < len(audio_files) else None
-            duration = self._estimate_duration(dialogue, audio_path)
-            clips.append(TimelineClip(dialogue=dialogue, audio_path=audio_path, duration_seconds=duration))
+        for dialogue, audio_path, duration in zip(dialogues, audio_paths, durations):
+            resolved_path: Optional[Path] = None
+            if audio_path is not None:
+                parent = audio_path.parent
+                if parent not in resolved_dirs:
+                    resolved_dirs[parent] = parent.resolve()
+                resolved_path = resolved_dirs[parent] / audio_path.name
+            clips.append(
+                TimelineClip(
+                    dialogue=dialogue,
+                    audio_path=audio_path,
+                    duration_seconds=duration,
+                    audio_path_resolved=resolved_path,
+                )
+            )
         return clips
 
     def _estimate_duration(self, dialogue: DialogueLine, audio_path: Optional[Path]) -> float:
-        if audio_path and audio_path.exists():
-            try:
-                with wave.open(str(audio_path), "rb") as handle:
-                    frames = handle.getnframes()
-                    rate = handle.getframerate() or DEFAULT_AUDIO_SAMPLERATE
-                    return max(frames / float(rate), 0.1)
-            except wave.Error:
-                pass
+        if audio_path:
+            duration = _read_wav_duration(audio_path)
+            if duration is not None:
+                return max(duration, 0.1)
         # Fallback: 0.18 seconds per character + 0.6 buffer
-        return max(len(dialogue.normalized_text()) * 0.18 + 0.6, 1.2)
+        return max(len(dialogue.text) * 0.18 + 0.6, 1.2)
+
+    def iter_xml_bytes(self, project_name: str, clips: List[TimelineClip]) -> Iterator[bytes]:
+        """Yield the Final Cut XML document for ``clips`` as UTF-8 encoded chunks.
 
-    def build_xml(self, project_name: str, clips: List[TimelineClip]) -> str:
+        Each clip is encoded as one chunk, so the document can be written with
+        ``writelines`` without ever holding all of it in memory.
+        """
         fps = self.fps
         audio_rate = DEFAULT_AUDIO_SAMPLERATE
-        lines = [
-            "<?xml version=\"1.0\" encoding=\"UTF-8\"?>",
-            "<!DOCTYPE xmeml> ",
-            "<xmeml version=\"5\">",
-            "  <sequence id=\"sequence-1\">",
-            f"    <name>{self._escape(project_name)}</name>",
-            "    <duration>0</duration>",
-            "    <rate>",
-            f"      <timebase>{fps}</timebase>",
-            "      <ntsc>FALSE</ntsc>",
-            "    </rate>",
-            "    <media>",
-            "      <video>",
-            "        <format>",
-            "          <samplecharacteristics>",
-            f"            <rate><timebase>{fps}</timebase><ntsc>FALSE</ntsc></rate>",
-            "            <width>1920</width>",
-            "            <height>1080</height>",
-            "            <anamorphic>FALSE</anamorphic>",
-            "            <pixelaspectratio>square</pixelaspectratio>",
-            "          </samplecharacteristics>",
-            "        </format>",
-            "        <track>",
-        ]
-
-        current_frame = 0
-        for index, clip in enumerate(clips, start=1):
-            start_tc = clip.start_timecode(current_frame, fps)
-            end_tc = clip.end_timecode(current_frame, fps)
-            lines.extend(
-                [
-                    f"          <generatoritem id=\"title-{index}\">",
-                    f"            <name>{self._escape(clip.dialogue.speaker)} Subtitle</name>",
-                    "            <generatoritemtype>text</generatoritemtype>",
-                    "            <rate>",
-                    f"              <timebase>{fps}</timebase>",
-                    "              <ntsc>FALSE</ntsc>",
-                    "            </rate>",
-                    f"            <start>{start_tc}</start>",
-                    f"            <end>{end_tc}</end>",
-                    f"            <in>{start_tc}</in>",
-                    f"            <out>{end_tc}</out>",
-                    "            <alphatype>straight</alphatype>",
-                    "            <effect>",
-                    "              <name>Text</name>",
-                    "              <effectid>text</effectid>",
-                    "              <effectcategory>Text</effectcategory>",
-                    "              <effecttype>text</effecttype>",
-                    "              <mediatype>video</mediatype>",
-                    "              <parameter authoringApp=\"PremierePro\">",
-                    "                <parameterid>str</parameterid>",
-                    "                <name>テキスト</name>",
-                    f"                <value>{self._escape(self._build_caption_text(clip))}</value>",
-                    "              </parameter>",
-                    "              <parameter authoringApp=\"PremierePro\">",
-                    "                <parameterid>style</parameterid>",
-                    "                <name>スタイル</name>",
-                    f"                <value>{self._style_for_speaker(clip.dialogue)}</value>",
-                    "              </parameter>",
-                    "            </effect>",
-                    "          </generatoritem>",
-                ]
-            )
-            current_frame += clip.duration_frames(fps)
-
-        lines.extend([
-            "        </track>",
-            "      </video>",
-            "      <audio>",
-            "        <track>",
-        ])
-
-        current_frame = 0
-        for index, clip in enumerate(clips, start=1):
-            start_tc = clip.start_timecode(current_frame, fps)
-            end_tc = clip.end_timecode(current_frame, fps)
-            if clip.audio_path:
-                lines.extend([
-                    f"          <clipitem id=\"audio-{index}\">",
-                    f"            <name>{self._escape(clip.audio_path.stem)}</name>",
-                    f"            <start>{start_tc}</start>",
-                    f"            <end>{end_tc}</end>",
-                    f"            <in>{start_tc}</in>",
-                    f"            <out>{end_tc}</out>",
-                    "            <file>",
-                    f"              <name>{self._escape(clip.audio_path.name)}</name>",
-                    f"              <pathurl>file://{self._escape(str(clip.audio_path.resolve()))}</pathurl>",
-                    "              <rate>",
-                    f"                <timebase>{audio_rate}</timebase>",
-                    "                <ntsc>FALSE</ntsc>",
-                    "              </rate>",
-                    "            </file>",
-                    "          </clipitem>",
-                ])
-            current_frame += clip.duration_frames(fps)
-
-        lines.extend([
-            "        </track>",
-            "      </audio>",
-            "    </media>",
-            "  </sequence>",
-            "</xmeml>",
-        ])
-
-        return "\n".join(lines)
+        yield _SEQUENCE_HEADER.format(name=self._escape(project_name), fps=fps).encode("utf-8")
+
+        # クリップの境界のタイムコードを一度だけ計算し、映像トラックと音声トラックで共有する。
+        # n 番目のクリップは boundaries[n - 1] から boundaries[n] までを占める。
+        frames = [clip.duration_frames(fps) for clip in clips]
+        boundaries = [_frames_to_timecode(frame, fps) for frame in accumulate(frames, initial=0)]
+        timed_clips = list(zip(clips, boundaries, boundaries[1:]))
+
+        for index, (clip, start_tc, end_tc) in enumerate(timed_clips, start=1):
+            yield _TITLE_CLIP_TEMPLATE.format(
+                index=index,
+                speaker=self._escape(clip.dialogue.speaker),
+                fps=fps,
+                start=start_tc,
+                end=end_tc,
+                caption=self._escape(self._build_caption_text(clip)),
+                style=self._style_for_speaker(clip.dialogue),
+            ).encode("utf-8")
+
+        yield _VIDEO_TO_AUDIO
+
+        # 同じ音声ファイルは最初の1回だけ <file> を完全に書き出し、以降は id で参照する。
+        file_ids: dict[Path, str] = {}
+        for index, (clip, start_tc, end_tc) in enumerate(timed_clips, start=1):
+            if not clip.audio_path:
+                continue
+            resolved_path = clip.audio_path_resolved or clip.audio_path.resolve()
+            file_id = file_ids.get(resolved_path)
+            if file_id is not None:
+                file_element = _AUDIO_FILE_REF_TEMPLATE.format(file_id=file_id)
+            else:
+                file_id = file_ids[resolved_path] = f"file-{len(file_ids) + 1}"
+                file_element = _AUDIO_FILE_TEMPLATE.format(
+                    file_id=file_id,
+                    name=self._escape(clip.audio_path.name),
+                    url=self._escape(resolved_path.as_uri()),
+                    rate=audio_rate,
+                )
+            yield _AUDIO_CLIP_TEMPLATE.format(
+                index=index,
+                name=self._escape(clip.audio_path.stem),
+                start=start_tc,
+                end=end_tc,
+                file=file_element,
+            ).encode("utf-8")
+
+        yield _SEQUENCE_FOOTER
 
     def _style_for_speaker(self, dialogue: DialogueLine) -> str:
-        speaker = dialogue.normalized_speaker()
+        speaker = dialogue.speaker
         if speaker == "霊夢":
             return "リンクスタイル霊夢"
         if speaker == "魔理沙":
@@ -187,16 +297,8 @@ class PremiereXmlBuilder:
         return "デフォルト字幕"
 
     def _build_caption_text(self, clip: TimelineClip) -> str:
-        speaker = clip.dialogue.normalized_speaker()
-        text = clip.dialogue.normalized_text()
-        return f"{speaker}: {text}"
+        return f"{clip.dialogue.speaker}: {clip.dialogue.text}"
 
     @staticmethod
     def _escape(value: str) -> str:
-        return (
-            value.replace("&", "&amp;")
-            .replace("<", "&lt;")
-            .replace(">", "&gt;")
-            .replace('"', "&quot;")
-            .replace("'", "&apos;")
-        )
+        return value.translate(_XML_ESCAPE)